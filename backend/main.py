@@ -5,51 +5,102 @@
 # using the ingestion and processing workers.
 
 from fastapi import FastAPI
-import xarray as xr
+from pydantic import BaseModel
+from concurrent.futures import ProcessPoolExecutor
+from typing import Literal, Optional, Union
+import multiprocessing
+import asyncio
+import time
 import os
 
 # Import your worker functions
-from workers.ingestion import get_latest_goes_file, run_wget
-from workers.processing import calc_cloud_fraction
+from workers.ingestion import get_latest_goes_file, open_goes_file
+from workers.processing import calc_cloud_fraction_file
 
 app = FastAPI(title="Cloud Cover App", version="0.1")
 
 
+# Response models. Declaring them as return types lets FastAPI serialize
+# responses straight to JSON bytes through Pydantic.
+
+class CloudCover(BaseModel):
+    cloud_cover_percent: Optional[float]  # NaN (no valid pixels) -> null
+    source_file: str
+
+
+class Error(BaseModel):
+    error: str
+
+
+# /cloud-cover accuracy levels -> pixel stride used when reducing the grid.
+# A 16x stride still samples ~30k pixels, well within 0.5% of the full answer.
+ACCURACY_STRIDES = {"high": 1, "medium": 4, "low": 16}
+
+# Worker processes for the S3 read + reduction, so concurrent requests
+# use separate cores instead of sharing one interpreter.
+# "spawn" because forking after s3fs/numba have started threads is unsafe.
+_EXECUTOR = ProcessPoolExecutor(
+    max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+)
+
+# Computed /cloud-cover responses: {(source file, accuracy): (time, response)}.
+# A GOES file never changes once published, so entries only expire to
+# keep the cache small once newer files have replaced them.
+_RESP_CACHE = {}
+_RESP_TTL = 30 * 60  # seconds
+
+
 @app.get("/health")
-def health_check():
+def health_check() -> dict[str, str]:
     """
     Basic test endpoint to confirm API is running.
     """
     return {"status": "ok"}
 
 
+def _compute_cloud_cover(key, stride=1):
+    """
+    Blocking part of /cloud-cover: range-read the file from S3
+    and reduce it to a cloud cover percentage. Runs in _EXECUTOR.
+    """
+    with open_goes_file(key) as f:
+        return calc_cloud_fraction_file(f, stride=stride)
+
+
 @app.get("/cloud-cover")
-def get_cloud_cover():
+async def get_cloud_cover(
+    accuracy: Literal["high", "medium", "low"] = "high",
+) -> Union[CloudCover, Error]:
     """
     Fetch the latest GOES data, process it,
     and return estimated cloud cover %.
+    Lower `accuracy` subsamples the grid for a much faster estimate.
     """
-    latest = get_latest_goes_file()
+    latest = await asyncio.to_thread(get_latest_goes_file)
     if not latest:
         return {"error": "No recent GOES files found"}
 
-    # Build URL
-    satellite = latest.split("/")[0]
     path = latest.split("/", 1)[1]
-    url = f"https://{satellite}.s3.amazonaws.com/{path}"
 
-    # Download file
-    local_file = run_wget(url)
-    if not local_file:
-        return {"error": "Failed to download GOES file"}
+    now = time.monotonic()
+    cached = _RESP_CACHE.get((path, accuracy))
+    if cached:
+        return cached[1]
 
+    # S3 reads and number crunching run in a worker process
+    loop = asyncio.get_running_loop()
     try:
-        ds = xr.open_dataset(local_file)
-        cloud_percent = calc_cloud_fraction(ds)
-        return {
-            "cloud_cover_percent": round(float(cloud_percent), 2),
-            "source_file": path
-        }
-    finally:
-        # Always clean up
-        os.remove(local_file)
+        cloud_percent = await loop.run_in_executor(
+            _EXECUTOR, _compute_cloud_cover, latest, ACCURACY_STRIDES[accuracy]
+        )
+    except OSError:
+        return {"error": "Failed to open GOES file"}
+
+    response = {
+        "cloud_cover_percent": round(float(cloud_percent), 2),
+        "source_file": path
+    }
+    for key in [k for k, (t, _) in _RESP_CACHE.items() if now - t >= _RESP_TTL]:
+        del _RESP_CACHE[key]
+    _RESP_CACHE[(path, accuracy)] = (now, response)
+    return response
@@ -7,15 +7,22 @@
 import s3fs          # lets us browse public S3 buckets (like a cloud filesystem)
 import xarray as xr  # works with large multidimensional datasets (like netCDF)
 import datetime      # used to build the folder path for today’s date/time
-import subprocess
-import os
+import time
+
+# One anonymous S3 connection shared by every call
+_FS = s3fs.S3FileSystem(anon=True)
+
+# S3 listings keyed by prefix: {prefix: (time listed, files)}.
+# New GOES files only arrive every few minutes, so a short TTL is safe.
+_LS_CACHE = {}
+_LS_TTL = 60  # seconds
 
 def get_latest_goes_file(product="ABI-L2-MCMIPC", satellite="noaa-goes19"):
     """
     Finds the latest GOES file in the NOAA AWS S3 bucket for a given product.
     Default product is ABI Cloud & Moisture Imagery (MCMIPC).
+    Listings are cached for _LS_TTL seconds.
     """
-    fs = s3fs.S3FileSystem(anon=True)
     now = datetime.datetime.now(datetime.timezone.utc)
     year = now.strftime("%Y")
     day_of_year = now.strftime("%j")
@@ -23,52 +30,41 @@ def get_latest_goes_file(product="ABI-L2-MCMIPC", satellite="noaa-goes19"):
 
     prefix = f"{satellite}/{product}/{year}/{day_of_year}/{hour}/"
 
+    listed_at, files = _LS_CACHE.get(prefix, (0.0, None))
+    if files and time.monotonic() - listed_at < _LS_TTL:
+        return files[-1]
+
     try:
-        files = fs.ls(prefix)
+        # refresh=True: bypass s3fs's own listing cache, which never expires
+        files = _FS.ls(prefix, refresh=True)
         if not files:
             raise ValueError("No files found for this hour")
+        listed_at = time.monotonic()
+        # Drop expired prefixes (previous hours) so the cache stays small
+        for stale in [p for p, (t, _) in _LS_CACHE.items() if listed_at - t >= _LS_TTL]:
+            del _LS_CACHE[stale]
+        _LS_CACHE[prefix] = (listed_at, files)
         return files[-1]
     except Exception as e:
         print(f"Error accessing {prefix}: {e}")
         return None
 
-def run_wget(url, output_path=None):
+def open_goes_file(key, block_size=2**20):
     """
-    Downloads a file using wget.
-    Returns the local file path if successful, else None.
+    Opens a GOES file straight from S3 for reading with HTTP Range requests.
+    Only the byte ranges xarray/HDF5 actually touch are fetched, blocks are
+    kept in an in-memory LRU cache, and the next block is prefetched in the
+    background so the network transfer overlaps with HDF5 decoding.
+    `key` is the bucket-qualified path returned by get_latest_goes_file.
     """
-    if output_path is None:
-        output_path = os.path.basename(url)  # use filename from URL
-
-    command = ["wget", "-q", url, "-O", output_path]
-    result = subprocess.run(command)
-
-    if result.returncode == 0:
-        print(f"Successfully downloaded {url} → {output_path}")
-        return output_path
-    else:
-        print(f"Error downloading {url}")
-        return None
+    return _FS.open(key, mode="rb", block_size=block_size, cache_type="background")
 
 if __name__ == "__main__":
     latest = get_latest_goes_file()
     if latest:
         print("Latest file:", latest)
 
-        # Build HTTPS URL properly
-        satellite = latest.split("/")[0]  # "noaa-goes19"
-        path = latest.split("/", 1)[1]    # "ABI-L2-MCMIPC/2025/080/12/OR_..."
-        url = f"https://{satellite}.s3.amazonaws.com/{path}"
-
-        # Download file locally
-        local_file = run_wget(url)
-        if local_file:
-            try:
-                # Load with xarray
-                ds = xr.open_dataset(local_file)
-                print(ds)
-                print("Variables:", list(ds.data_vars))
-            finally:
-                # Cleanup
-                os.remove(local_file)
-                print(f"Removed temp file {local_file}")
\ No newline at end of file
+        # Stream from S3 and load with xarray
+        with open_goes_file(latest) as f, xr.open_dataset(f, engine="h5netcdf") as ds:
+            print(ds)
+            print("Variables:", list(ds.data_vars))
@@ -6,85 +6,273 @@
 #   - IR + Visible bands (2 & 3) during daytime
 # Also includes optional visualization functions.
 
+from concurrent.futures import ThreadPoolExecutor
+import math
+
 import numpy as np
-import matplotlib.pyplot as plt
+import h5py
+from numba import njit
 import xarray as xr
-import datetime
-import os
+
+# Bands used for cloud detection: VIS 2 & 3 (day) and IR 13
+CLOUD_BANDS = ["CMI_C02", "CMI_C03", "CMI_C13"]
 
 # -----------------------------
 # Core Cloud Detection Functions
 # -----------------------------
 
+def open_bands(source, bands=CLOUD_BANDS, decode=True):
+    """
+    Opens a GOES MCMIP file (path or file object) with xarray,
+    dropping the CMI/DQF variables of every band not in `bands`.
+    With decode=False bands keep their stored integer values and the
+    scale_factor/add_offset/_FillValue attributes (no CF decoding).
+    """
+    keep = {b.split("_")[-1] for b in bands}
+    drop = [f"{kind}_C{i:02d}" for i in range(1, 17) for kind in ("CMI", "DQF")
+            if f"C{i:02d}" not in keep]
+    return xr.open_dataset(source, engine="h5netcdf", drop_variables=drop, decode_cf=decode)
+
+
+def _attr_str(value):
+    """
+    String attribute as str. h5py returns netCDF text attributes as bytes.
+    """
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
 def is_daytime(ds):
     """
     Rough day/night check based on dataset time and satellite projection.
     Uses 't' attribute from GOES file.
+    Works on xarray Datasets and h5py Files alike.
     """
     # Extract scan start time from dataset metadata
     if "time_coverage_start" in ds.attrs:
-        scan_start = datetime.datetime.fromisoformat(
-            ds.attrs["time_coverage_start"].replace("Z", "+00:00")
-        )
+        scan_start = _attr_str(ds.attrs["time_coverage_start"])
     else:
         # fallback: assume day for testing
         return True
 
-    # For MVP: simple check using UTC hour
-    hour = scan_start.hour
+    # For MVP: simple check using UTC hour.
+    # GOES timestamps are always "YYYY-MM-DDTHH:MM:SS.sZ", so slice the hour out.
+    hour = int(scan_start[11:13])
     return 6 <= hour <= 18  # crude, 6 UTC–18 UTC = daytime
 
 
-def calc_cloud_fraction_ir(ds, band="CMI_C13", threshold=280.0):
+@njit(nogil=True, boundscheck=False, cache=True)
+def _ir_counts(ir, ir_threshold, ir_fill, mask=None):
+    """
+    Single pass over the IR grid.
+    Returns (cloudy pixels, valid pixels): valid means neither NaN nor
+    `ir_fill`, cloudy means valid and below `ir_threshold`.
+    If a bool `mask` array is given, the per-pixel cloudy flags are
+    written into it.
+    """
+    cloud = 0
+    total = 0
+    # Branch-free body so LLVM can vectorize the loop
+    # (the mask branch is compiled away when mask is None)
+    for i in range(ir.size):
+        x = ir[i]
+        valid = (x == x) & (x != ir_fill)
+        cloudy = valid & (x < ir_threshold)
+        total += valid
+        cloud += cloudy
+        if mask is not None:
+            mask[i] = cloudy
+    return cloud, total
+
+
+@njit(nogil=True, boundscheck=False, cache=True)
+def _multiband_counts(ir, vis, ir_threshold, ir_fill, vis_thresholds, vis_fills, mask=None):
+    """
+    Same as _ir_counts, but a valid pixel is also cloudy when any band
+    in the (non-empty) `vis` tuple is above its entry in `vis_thresholds`
+    (fill values excluded).
+    """
+    cloud = 0
+    total = 0
+    for i in range(ir.size):
+        x = ir[i]
+        valid = (x == x) & (x != ir_fill)
+        cloudy = x < ir_threshold
+        for j in range(len(vis)):
+            v = vis[j][i]
+            cloudy |= (v > vis_thresholds[j]) & (v != vis_fills[j])
+        cloudy &= valid
+        total += valid
+        cloud += cloudy
+        if mask is not None:
+            mask[i] = cloudy
+    return cloud, total
+
+
+def _stored_dtype(var):
+    """
+    dtype of a band's values as stored, honouring the netCDF
+    _Unsigned convention (GOES stores uint16 counts as int16).
+    """
+    dtype = var.dtype
+    if dtype.kind == "i" and _attr_str(var.attrs.get("_Unsigned", "")) == "true":
+        dtype = np.dtype(f"u{dtype.itemsize}")
+    return dtype
+
+
+def _stored_threshold(var, threshold, below):
+    """
+    Converts a physical threshold into the band's stored units, so raw
+    counts can be compared directly without applying scale_factor and
+    add_offset to every pixel. Returns (threshold, fill value), both of
+    _stored_dtype(var). `below` says whether the test is value < threshold
+    (else value > threshold).
+    Already decoded float bands pass through, with NaN as the fill value.
+    """
+    dtype = _stored_dtype(var)
+    if dtype.kind == "f":
+        return dtype.type(threshold), dtype.type(np.nan)
+
+    info = np.iinfo(dtype)
+    scale = np.asarray(var.attrs.get("scale_factor", 1.0)).item()
+    offset = np.asarray(var.attrs.get("add_offset", 0.0)).item()
+    fill = np.asarray(var.attrs.get("_FillValue", info.min), dtype=var.dtype)
+
+    # For integer counts (and scale_factor > 0, as in GOES):
+    #   value < t  <=>  count < ceil(t')      value > t  <=>  count > floor(t')
+    raw = (threshold - offset) / scale
+    raw = np.ceil(raw) if below else np.floor(raw)
+    raw = min(max(raw, info.min), info.max)
+    return dtype.type(raw), fill.reshape(()).view(dtype)[()]
+
+
+def _iter_blocks(ds, bands, rows=256, stride=1):
+    """
+    Yields the given bands one horizontal slab of about `rows` rows at a
+    time, each flattened to 1-D. Only the slab is read from the file, so
+    the full grid is never materialized. `ds` can be an xarray Dataset or
+    an h5py File; for chunked HDF5 datasets slabs are aligned to whole
+    chunk rows so each chunk is decompressed exactly once.
+    With stride > 1 only every `stride`-th row and column is read.
+    The next slab is read on a background thread while the caller
+    reduces the current one (the kernels release the GIL).
+    """
+    dtypes = [_stored_dtype(ds[b]) for b in bands]
+    ny = ds[bands[0]].shape[0]
+    chunks = getattr(ds[bands[0]], "chunks", None)
+    if chunks and isinstance(chunks[0], int):  # HDF5 chunk shape (h5py)
+        step = math.lcm(chunks[0], stride)
+    else:
+        step = stride
+    rows = max(rows // step, 1) * step  # keep slabs on the chunk and stride grid
+
+    def read(y0):
+        # Kernels get C-contiguous 1-D arrays (stride-1 loops that vectorize);
+        # ascontiguousarray copies only if the backend returned a strided view
+        return [np.ascontiguousarray(ds[b][y0:y0 + rows:stride, ::stride]).view(dt).reshape(-1)
+                for b, dt in zip(bands, dtypes)]
+
+    starts = range(0, ny, rows)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(read, starts[0])
+        for y0 in starts[1:]:
+            block = pending.result()
+            pending = pool.submit(read, y0)
+            yield block
+        yield pending.result()
+
+
+def _empty_mask(var, stride):
+    """
+    Uninitialized bool array shaped like `var` subsampled by `stride`.
+    """
+    return np.empty(tuple(-(-n // stride) for n in var.shape), dtype=bool)
+
+
+def calc_cloud_fraction_ir(ds, band="CMI_C13", threshold=280.0, stride=1, return_mask=False):
     """
     Cloud fraction from IR Band 13.
+    Works on decoded or raw (decode_cf=False) datasets and on h5py Files.
+    `stride` subsamples the grid (every stride-th pixel in x and y).
+    With return_mask=True, returns (fraction, cloud mask) instead.
     """
-    data = ds[band].values
-    mask = data < threshold
-    cloud_pixels = np.sum(mask)
-    total_pixels = np.sum(~np.isnan(data))
-    return (cloud_pixels / total_pixels) * 100 if total_pixels > 0 else np.nan
+    raw_threshold, fill = _stored_threshold(ds[band], threshold, below=True)
+    mask = _empty_mask(ds[band], stride) if return_mask else None
+
+    cloud_pixels = total_pixels = offset = 0
+    for (data,) in _iter_blocks(ds, [band], stride=stride):
+        out = None if mask is None else mask.reshape(-1)[offset:offset + data.size]
+        cloud, total = _ir_counts(data, raw_threshold, fill, out)
+        cloud_pixels += cloud
+        total_pixels += total
+        offset += data.size
+    frac = (cloud_pixels / total_pixels) * 100 if total_pixels > 0 else np.nan
+    return (frac, mask) if return_mask else frac
 
 
 def calc_cloud_fraction_multiband(ds, ir_band="CMI_C13", vis_bands=["CMI_C02", "CMI_C03"],
-                                  ir_threshold=280.0, vis_threshold=0.3):
+                                  ir_threshold=280.0, vis_threshold=0.3, stride=1,
+                                  return_mask=False):
     """
     Cloud fraction using IR + VIS bands (daytime only).
+    Works on decoded or raw (decode_cf=False) datasets and on h5py Files.
+    `stride` subsamples the grid (every stride-th pixel in x and y).
+    With return_mask=True, returns (fraction, cloud mask) instead.
     """
-    ir_data = ds[ir_band].values
-    ir_mask = ir_data < ir_threshold
+    vis_bands = [vb for vb in vis_bands if vb in ds]
+    if not vis_bands:
+        return calc_cloud_fraction_ir(ds, band=ir_band, threshold=ir_threshold, stride=stride,
+                                      return_mask=return_mask)
 
-    vis_masks = []
-    for vb in vis_bands:
-        if vb in ds:
-            vis_data = ds[vb].values
-            vis_masks.append(vis_data > vis_threshold)
-    if vis_masks:
-        vis_mask = np.logical_or.reduce(vis_masks)
-    else:
-        vis_mask = np.zeros_like(ir_mask, dtype=bool)
+    ir_raw_threshold, ir_fill = _stored_threshold(ds[ir_band], ir_threshold, below=True)
+    vis_raw = [_stored_threshold(ds[vb], vis_threshold, below=False) for vb in vis_bands]
+    vis_dtype = _stored_dtype(ds[vis_bands[0]])
+    vis_thresholds = np.array([t for t, _ in vis_raw], dtype=vis_dtype)
+    vis_fills = np.array([f for _, f in vis_raw], dtype=vis_dtype)
+    mask = _empty_mask(ds[ir_band], stride) if return_mask else None
 
-    combined = np.logical_or(ir_mask, vis_mask)
-    total_pixels = np.sum(~np.isnan(ir_data))
-    cloud_pixels = np.sum(combined)
-    return (cloud_pixels / total_pixels) * 100 if total_pixels > 0 else np.nan
+    cloud_pixels = total_pixels = offset = 0
+    for ir_data, *vis_data in _iter_blocks(ds, [ir_band] + vis_bands, stride=stride):
+        out = None if mask is None else mask.reshape(-1)[offset:offset + ir_data.size]
+        cloud, total = _multiband_counts(ir_data, tuple(vis_data), ir_raw_threshold, ir_fill,
+                                         vis_thresholds, vis_fills, out)
+        cloud_pixels += cloud
+        total_pixels += total
+        offset += ir_data.size
+    frac = (cloud_pixels / total_pixels) * 100 if total_pixels > 0 else np.nan
+    return (frac, mask) if return_mask else frac
 
 
-def calc_cloud_fraction(ds):
+def calc_cloud_fraction(ds, stride=1, return_mask=False):
     """
     Main wrapper: choose IR-only (night) vs IR+VIS (day).
     """
     if is_daytime(ds):
-        return calc_cloud_fraction_multiband(ds)
+        return calc_cloud_fraction_multiband(ds, stride=stride, return_mask=return_mask)
     else:
-        return calc_cloud_fraction_ir(ds)
+        return calc_cloud_fraction_ir(ds, stride=stride, return_mask=return_mask)
+
+
+def calc_cloud_fraction_file(source, stride=1):
+    """
+    Same as calc_cloud_fraction, but opens `source` (path or file object)
+    itself. The file is read with h5py directly: only the attributes and
+    the bands actually reduced are touched, the thresholds run on the
+    stored int16 counts, and there is no xarray/CF decoding overhead.
+    """
+    with h5py.File(source, "r") as f:
+        return calc_cloud_fraction(f, stride=stride)
 
 
 # -----------------------------
 # Visualization Helpers
 # -----------------------------
 
+# matplotlib is imported inside the plot helpers so the API,
+# which never plots, doesn't pay for it at startup.
+
 def plot_band(ds, band="CMI_C13", save_path="band_plot.png"):
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 8))
     plt.imshow(ds[band], cmap="gray")
     plt.colorbar(label="Value")
@@ -94,17 +282,25 @@ def plot_band(ds, band="CMI_C13", save_path="band_plot.png"):
     print(f"Saved {save_path}")
 
 
-def plot_cloud_mask(ds, save_path="cloud_mask.png"):
-    if is_daytime(ds):
-        mask_value = ds["CMI_C13"].values < 280.0
-        for vb in ["CMI_C02", "CMI_C03"]:
-            if vb in ds:
-                mask_value |= (ds[vb].values > 0.3)
-    else:
-        mask_value = ds["CMI_C13"].values < 280.0
+def plot_cloud_mask(ds, save_path="cloud_mask.png", mask=None):
+    """
+    Plots the cloud mask. Pass the `mask` returned by
+    calc_cloud_fraction(..., return_mask=True) to skip recomputing it.
+    """
+    import matplotlib.pyplot as plt
+
+    if mask is None:
+        mask = ds["CMI_C13"].values < 280.0
+        if is_daytime(ds):
+            # OR each VIS mask in place, reusing one scratch buffer
+            vis_mask = np.empty_like(mask)
+            for vb in ["CMI_C02", "CMI_C03"]:
+                if vb in ds:
+                    np.greater(ds[vb].values, 0.3, out=vis_mask)
+                    np.logical_or(mask, vis_mask, out=mask)
 
     plt.figure(figsize=(10, 8))
-    plt.imshow(mask_value, cmap="Blues")
+    plt.imshow(mask, cmap="Blues")
     plt.title("Cloud Mask")
     plt.savefig(save_path, dpi=150)
     plt.close()
@@ -116,25 +312,13 @@ def plot_cloud_mask(ds, save_path="cloud_mask.png"):
 # -----------------------------
 
 if __name__ == "__main__":
-    from ingestion import get_latest_goes_file, run_wget
-    
+    from ingestion import get_latest_goes_file, open_goes_file
+
     latest = get_latest_goes_file()
     if latest:
-        satellite = latest.split("/")[0]
-        path = latest.split("/", 1)[1]
-        url = f"https://{satellite}.s3.amazonaws.com/{path}"
-
-        local_file = run_wget(url)
-        if local_file:
-            try:
-                ds = xr.open_dataset(local_file)
-
-                cloud_percent = calc_cloud_fraction(ds)
-                print(f"Estimated Cloud Cover: {cloud_percent:.2f}%")
-
-                plot_band(ds, band="CMI_C13")
-                plot_cloud_mask(ds)
+        with open_goes_file(latest) as f, open_bands(f) as ds:
+            cloud_percent, mask = calc_cloud_fraction(ds, return_mask=True)
+            print(f"Estimated Cloud Cover: {cloud_percent:.2f}%")
 
-            finally:
-                os.remove(local_file)
-                print(f"Removed temp file {local_file}")
\ No newline at end of file
+            plot_band(ds, band="CMI_C13")
+            plot_cloud_mask(ds, mask=mask)